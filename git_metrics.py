@@ -1,15 +1,88 @@
-import copy
-import itertools
+import functools
+import json
 import logging
 import os
 import re
 import subprocess
 import tempfile
+import threading
 
-from multiprocessing.dummy import Pool as ThreadPool
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 
+try:
+    # libyaml C scanner, much faster than the pure-Python loader
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# shared by every git subprocess instead of opening os.devnull per call
+_DEVNULL = open(os.devnull, 'r+b')
+
+_REPO_RE = re.compile(
+    r'^https://(?P<provider>gitlab\.cee\.redhat\.com|github\.com)/'
+    r'(?P<org>[^/]+)/(?P<repo>[^/]+?)(?:\.git)?/?$')
+
+_PROVIDER_NAMES = {
+    'gitlab.cee.redhat.com': 'gitlab',
+    'github.com': 'github',
+}
+
+# upstream repos shared across saas repos are cloned and pulled once per
+# process: {url: GitMetrics}
+_REPO_METRICS_CACHE = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _partial_clone_args():
+    """
+    Returns ['--filter=blob:none'] when the installed git supports
+    partial clone (>= 2.19), otherwise an empty list so clones and
+    fetches degrade to full ones.
+    """
+
+    try:
+        version = subprocess.check_output(['git', 'version'])
+    except (OSError, subprocess.CalledProcessError):
+        return []
+
+    match = re.search(r'(\d+)\.(\d+)', version.decode('utf-8'))
+    if match is None:
+        return []
+
+    if (int(match.group(1)), int(match.group(2))) < (2, 19):
+        return []
+
+    return ['--filter=blob:none']
+
+
+@functools.lru_cache(maxsize=None)
+def _canonicalize_url(repo):
+    # remove '/' suffix if it exists
+    if repo[-1] == '/':
+        repo = repo[:-1]
+
+    # add '.git' if necessary
+    if not repo.endswith('.git'):
+        repo = repo + '.git'
+
+    return repo
+
+
+@functools.lru_cache(maxsize=None)
+def _short_repo(repo):
+    match = _REPO_RE.match(repo)
+
+    if match is None:
+        raise Exception("Unknown provider for {}".format(repo))
+
+    return "{}-{}-{}".format(_PROVIDER_NAMES[match.group('provider')],
+                             match.group('org'),
+                             match.group('repo'))
+
 
 class GitCommandError(Exception):
     pass
@@ -38,6 +111,26 @@ class GitMetrics(object):
 
         self.clone_or_pull()
 
+        self._catfile = None
+        self._catfile_check = None
+        self._catfile_lock = threading.Lock()
+        self._catfile_check_lock = threading.Lock()
+
+        # memoizes git lookups that are stable for the instance lifetime,
+        # keyed by (method, commit)
+        self._cache = {}
+
+    def __del__(self):
+        for attr in ('_catfile', '_catfile_check'):
+            catfile = getattr(self, attr, None)
+            if catfile is not None:
+                try:
+                    catfile.stdin.close()
+                    catfile.stdout.close()
+                    catfile.wait()
+                except Exception:
+                    pass
+
     def clone_or_pull(self):
         if not os.path.isdir(self.git_dir):
             self.clone()
@@ -47,8 +140,12 @@ class GitMetrics(object):
     def clone(self):
         logging.info(['cloning', self.repo])
         if self.bare:
-            subprocess.call(['git', 'clone', '--bare', '--quiet', self.repo,
-                             self.work_dir])
+            # bare clones are only consulted for commit counts and object
+            # reads at a few commits: skip blobs until they are needed
+            clone_cmd = ['git', 'clone', '--bare', '--quiet']
+            clone_cmd += _partial_clone_args()
+            clone_cmd += [self.repo, self.work_dir]
+            subprocess.call(clone_cmd)
         else:
             subprocess.call(['git', 'clone', '--quiet', self.repo,
                              self.work_dir])
@@ -71,7 +168,9 @@ class GitMetrics(object):
         logging.info(['pulling', self.repo])
 
         if self.bare:
-            self._git_command(["fetch", "-q", "origin", "master"])
+            fetch_cmd = ["fetch", "-q"] + _partial_clone_args()
+            fetch_cmd += ["origin", "master"]
+            self._git_command(fetch_cmd)
             self._git_command(["update-ref", "HEAD", "FETCH_HEAD"])
         else:
             self._git_command(["pull", "-q"])
@@ -80,13 +179,40 @@ class GitMetrics(object):
             f.write(str(os.getpid()))
 
     def get_file(self, commit, path):
-        return self._git_command(['show', '{}:{}'.format(commit, path)])
+        return self._cat('{}:{}'.format(commit, path))
 
     def ls_files_dir(self, commit, path):
-        ls_tree_cmd = ['ls-tree', '--name-only', commit, path.rstrip('/')+'/']
-        return self._git_command(ls_tree_cmd).splitlines()
+        ls_tree_cmd = ['ls-tree', '-r', '--name-only', commit,
+                       path.rstrip('/')+'/']
+        out = self._git_command(ls_tree_cmd).decode('utf-8')
+        return out.splitlines()
+
+    def ls_blobs_dir(self, commit, path):
+        """
+        Returns a list of (path, blob_sha) tuples for the files under
+        path at commit
+        """
+
+        ls_tree_cmd = ['ls-tree', '-r', commit, path.rstrip('/')+'/']
+        out = self._git_command(ls_tree_cmd).decode('utf-8')
+
+        blobs = []
+        for line in out.splitlines():
+            meta, _, name = line.partition('\t')
+            _, obj_type, sha = meta.split()
+            if obj_type == 'blob':
+                blobs.append((name, sha))
+
+        return blobs
 
     def count(self, commit="HEAD"):
+        cache_key = ('count', commit)
+        if cache_key not in self._cache:
+            self._cache[cache_key] = self._count(commit)
+
+        return self._cache[cache_key]
+
+    def _count(self, commit):
         try:
             # if the commit is not a valid branch/sha it's probably something
             # like `none`, `ignore`, etc. In those case we want to return total
@@ -96,7 +222,7 @@ class GitMetrics(object):
             commit = "HEAD"
 
         fist_command_cmd = ["rev-list", "--max-parents=0", "HEAD"]
-        first_commit = self._git_command(fist_command_cmd)
+        first_commit = self._git_command(fist_command_cmd).decode('utf-8')
 
         count_cmd = ['rev-list',
                      '{}..{}'.format(first_commit, commit),
@@ -105,25 +231,121 @@ class GitMetrics(object):
         return int(self._git_command(count_cmd))
 
     def commit_ts(self, commit):
-        commit_ts_cmd = ['show', '-s', '--format=%ct', commit]
-        return int(self._git_command(commit_ts_cmd))
+        cache_key = ('commit_ts', commit)
+        if cache_key not in self._cache:
+            self._cache[cache_key] = \
+                self._parse_commit_ts(self._cat(commit))
+
+        return self._cache[cache_key]
+
+    @staticmethod
+    def _parse_commit_ts(commit_obj):
+        # the committer header line is 'committer <name> <email> <ts> <tz>',
+        # matching what `git show --format=%ct` reported
+        for line in commit_obj.splitlines():
+            if not line:
+                break
+            if line.startswith(b'committer '):
+                return int(line.split()[-2])
+
+        raise GitCommandError("no committer header in commit object")
 
     def rev_parse(self, commit):
-        return self._git_command(['rev-parse', '-q', commit])
+        cache_key = ('rev_parse', commit)
+        if cache_key not in self._cache:
+            sha, _, _ = self._object_info(commit)
+            self._cache[cache_key] = sha
+
+        return self._cache[cache_key]
 
     def is_sha(self, h):
         return len(str(h)) == 40
 
+    def _open_catfile(self):
+        if self._catfile is None or self._catfile.poll() is not None:
+            catfile_cmd = ['git', '--git-dir', self.git_dir,
+                           'cat-file', '--batch']
+            self._catfile = subprocess.Popen(catfile_cmd,
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE)
+
+        return self._catfile
+
+    def _open_catfile_check(self):
+        if self._catfile_check is None or \
+                self._catfile_check.poll() is not None:
+            check_cmd = ['git', '--git-dir', self.git_dir,
+                         'cat-file', '--batch-check']
+            self._catfile_check = subprocess.Popen(check_cmd,
+                                                   stdin=subprocess.PIPE,
+                                                   stdout=subprocess.PIPE)
+
+        return self._catfile_check
+
+    def _object_info(self, ref):
+        """
+        Resolves ref to (sha, type, size) through a long-lived
+        `git cat-file --batch-check` subprocess, without transferring
+        the object payload.
+        """
+
+        # the count fan-out in services_with_info reaches this pipe from
+        # several threads when services share an upstream: serialize the
+        # write/read pair so responses stay matched to requests
+        with self._catfile_check_lock:
+            catfile = self._open_catfile_check()
+
+            catfile.stdin.write(ref.encode('utf-8') + b'\n')
+            catfile.stdin.flush()
+
+            header = catfile.stdout.readline()
+
+        if not header or header.rstrip().endswith(b'missing'):
+            msg = "object {} missing in {}".format(ref, self.repo)
+            raise GitCommandError(msg)
+
+        sha, obj_type, size = header.split()
+
+        return (sha.decode('utf-8'), obj_type.decode('utf-8'), int(size))
+
+    def _cat(self, ref):
+        """
+        Reads a git object through a long-lived `git cat-file --batch`
+        subprocess instead of forking a `git show` per object.
+        """
+
+        with self._catfile_lock:
+            catfile = self._open_catfile()
+
+            catfile.stdin.write(ref.encode('utf-8') + b'\n')
+            catfile.stdin.flush()
+
+            header = catfile.stdout.readline()
+
+            if not header or header.rstrip().endswith(b'missing'):
+                msg = "object {} missing in {}".format(ref, self.repo)
+                raise GitCommandError(msg)
+
+            _, _, size = header.split()
+
+            # the payload is followed by a framing newline
+            payload = catfile.stdout.read(int(size) + 1)
+
+        return payload[:-1]
+
     def _git_command(self, cmd):
-        devnull = open(os.devnull, 'wb')
         git_cmd = ['git', '--git-dir', self.git_dir] + cmd
 
         p = subprocess.Popen(git_cmd,
-                             stdin=subprocess.PIPE,
-                             stderr=devnull,
+                             stdin=_DEVNULL,
+                             stderr=_DEVNULL,
                              stdout=subprocess.PIPE)
 
-        out, _ = p.communicate()
+        # nothing is ever written to stdin, so read stdout directly
+        # instead of paying for communicate()'s buffering machinery
+        out = p.stdout.read()
+        p.stdout.close()
+        p.wait()
 
         if p.returncode != 0:
             msg = "error running {} in {}".format(git_cmd, self.repo)
@@ -132,67 +354,59 @@ class GitMetrics(object):
         return out.strip()
 
     def _short_repo(self, repo):
-        gitlab_prefix = 'https://gitlab.cee.redhat.com/'
-        github_prefix = 'https://github.com/'
-
-        if repo.startswith(gitlab_prefix):
-            provider = 'gitlab'
-            short_repo = repo[len(gitlab_prefix):]
-        elif repo.startswith(github_prefix):
-            short_repo = repo[len(github_prefix):]
-            provider = 'github'
-        else:
-            raise Exception("Unknown provider for {}".format(repo))
-
-        short_repo = self._canonicalize_url(short_repo)
-        short_repo_split = short_repo.split("/")
-
-        if len(short_repo_split) != 2:
-            raise Exception("Expecting only two components {}".format(repo))
-
-        org, repo = short_repo_split
-
-        # remove '.git'
-        suffix = '.git'
-        assert repo.endswith(suffix)
-        repo = repo[:-len(suffix)]
-
-        return "{}-{}-{}".format(provider, org, repo)
+        return _short_repo(_canonicalize_url(repo))
 
     def _canonicalize_url(self, repo):
-        # remove '/' suffix if it exists
-        if repo[-1] == '/':
-            repo = repo[:-1]
-
-        # add '.git' if necessary
-        if not repo.endswith('.git'):
-            repo = repo + '.git'
-
-        return repo
+        return _canonicalize_url(repo)
 
 
 class SaasGitMetrics(GitMetrics):
+    SERVICE_FIELDS = ['name', 'url', 'hash']
+
     def __init__(self, repo, poolsize, **kwds):
         super(SaasGitMetrics, self).__init__(repo, **kwds)
         self.poolsize = poolsize
         self.cache = kwds.get('cache', False)
         self.upstream_repo_metrics = {}
 
+        # parsed services files keyed by blob sha
+        self._blob_services_cache = {}
+
+        # get_yaml reads through the resident cat-file pipe (no extra
+        # subprocess) and takes the JSON sidecar fast path when present
         try:
-            config_yaml = self.get_file('HEAD', 'config.yaml')
+            config = self.get_yaml('HEAD', 'config.yaml')
         except GitCommandError:
             raise SaasConfigReadError()
 
-        config = yaml.safe_load(config_yaml)
         self.contexts = config['contexts']
 
     def get_yaml(self, commit, path):
-        data = self._git_command(['show', '{}:{}'.format(commit, path)])
-        return yaml.safe_load(data)
+        # a pre-converted JSON sidecar (e.g. produced with yq during the
+        # repo's own CI) parses much faster than YAML: prefer it when the
+        # repo ships one next to the YAML file
+        try:
+            sidecar = self._cat('{}:{}.json'.format(commit, path))
+            return json.loads(sidecar)
+        except (GitCommandError, ValueError):
+            pass
+
+        data = self._cat('{}:{}'.format(commit, path))
+        return yaml.load(data, Loader=YamlLoader)
 
-    def get_services(self, commit, path):
+    def get_services(self, blob_sha):
+        # blob shas are stable across commits that don't touch the file,
+        # so most history-walk lookups are cache hits with no YAML parse
+        if blob_sha not in self._blob_services_cache:
+            self._blob_services_cache[blob_sha] = \
+                self._parse_services(blob_sha)
+
+        return [service.copy()
+                for service in self._blob_services_cache[blob_sha]]
+
+    def _parse_services(self, ref):
         try:
-            services_file = self.get_yaml(commit, path)
+            services_file = yaml.load(self._cat(ref), Loader=YamlLoader)
         except (GitCommandError, yaml.scanner.ScannerError):
             return []
 
@@ -203,55 +417,152 @@ class SaasGitMetrics(GitMetrics):
         if not isinstance(services, list):
             return []
 
-        return services
+        # only keep the fields we actually consume downstream
+        return [
+            {k: service.get(k) for k in self.SERVICE_FIELDS}
+            for service in services
+            if isinstance(service, dict)
+        ]
+
+    def _preclone(self, repos):
+        """
+        Clones the upstream repos that are not on disk yet concurrently;
+        clones are pure network/disk I/O so an async subprocess fan-out
+        scales better than a thread per clone. fetch_repo_metrics then
+        finds the clones in the cache dir.
+        """
+
+        to_clone = [
+            (repo, os.path.join(self.cache, self._short_repo(repo)))
+            for repo in repos
+            if repo not in _REPO_METRICS_CACHE
+        ]
+
+        to_clone = [(repo, work_dir)
+                    for repo, work_dir in to_clone
+                    if not os.path.isdir(work_dir)]
+
+        if not to_clone:
+            return
+
+        asyncio.run(self._clone_all(to_clone))
+
+    async def _clone_all(self, to_clone):
+        semaphore = asyncio.Semaphore(self.poolsize)
+
+        async def clone_one(repo, work_dir):
+            async with semaphore:
+                logging.info(['cloning', repo])
+                clone_cmd = ['git', 'clone', '--bare', '--quiet']
+                clone_cmd += _partial_clone_args()
+                clone_cmd += [repo, work_dir]
+                proc = await asyncio.create_subprocess_exec(
+                    *clone_cmd,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL)
+                await proc.wait()
+
+                if proc.returncode == 0:
+                    # a fresh clone is up to date: mark it pulled so
+                    # GitMetrics skips the fetch for this process
+                    ts_file = os.path.join(work_dir, 'git_metrics_ts_pull')
+                    with open(ts_file, 'w') as f:
+                        f.write(str(os.getpid()))
+
+        await asyncio.gather(*[clone_one(repo, work_dir)
+                               for repo, work_dir in to_clone])
 
     def fetch_repo_metrics(self, repo):
-        repo_metrics = GitMetrics(repo, bare=True, cache=self.cache)
-        return (repo, repo_metrics)
+        if repo not in _REPO_METRICS_CACHE:
+            _REPO_METRICS_CACHE[repo] = GitMetrics(repo, bare=True,
+                                                   cache=self.cache)
+
+        return (repo, _REPO_METRICS_CACHE[repo])
+
+    def _services_tree_sha(self, commit, path):
+        try:
+            sha, _, _ = self._object_info(
+                '{}:{}'.format(commit, path.rstrip('/')))
+        except GitCommandError:
+            return None
+
+        return sha
 
     def services(self, commit='HEAD'):
         """
         Returns a dict of tuples {(context, service_name): service}
         """
 
-        return {
-            (c['name'], service['name']): service
+        # key the cache on the services-dir tree oids: commits that only
+        # touched unrelated files share the same trees, so the history
+        # walk reuses the parsed result without even listing the dirs
+        tree_shas = tuple(
+            self._services_tree_sha(commit, c['data']['services_dir'])
             for c in self.contexts
-            for sf in self.ls_files_dir(commit, c['data']['services_dir'])
-            for service in self.get_services(commit, sf)
-        }
+        )
+
+        cache_key = ('services', tree_shas)
+        if cache_key not in self._cache:
+            self._cache[cache_key] = {
+                (c['name'], service['name']): service
+                for c in self.contexts
+                for _, blob_sha in self.ls_blobs_dir(
+                    commit, c['data']['services_dir'])
+                for service in self.get_services(blob_sha)
+            }
+
+        return self._cache[cache_key]
 
     def services_with_info(self, commit='HEAD'):
         services = self.services(commit)
 
-        # fetch all repos
-        upstream_urls = set([self._canonicalize_url(service['url'])
-                             for service in services.values()])
+        # canonicalize each service's upstream once; everything below is
+        # dict lookups against this table
+        service_pairs = {
+            service_tuple: (self._canonicalize_url(service['url']),
+                            service['hash'] or "HEAD")
+            for service_tuple, service in services.items()
+        }
 
+        # fetch all repos
+        upstream_urls = set(url for url, _ in service_pairs.values())
         upstream_urls = list(upstream_urls - set([self.repo]))
 
-        if self.poolsize > 0:
-            pool = ThreadPool(self.poolsize)
-            repo_metrics_tuples = pool.map(self.fetch_repo_metrics,
-                                           upstream_urls)
+        if self.poolsize > 0 and self.cache:
+            self._preclone(upstream_urls)
 
-            repo_metrics = {k: v for (k, v) in repo_metrics_tuples}
-        else:
-            repo_metrics = {
-                repo: self.fetch_repo_metrics(repo)[1]
-                for repo in upstream_urls
-            }
+        repo_metrics = {
+            repo: self.fetch_repo_metrics(repo)[1]
+            for repo in upstream_urls
+        }
 
         repo_metrics[self.repo] = self
 
-        for (context_name, _), service in services.items():
-            url = self._canonicalize_url(service['url'])
-            h = service['hash']
-            if not h:
-                h = "HEAD"
+        # many services share the same upstream url and hash: compute
+        # each (url, hash) count pair only once
+        count_pairs = set(service_pairs.values())
+
+        # the counts are independent fork+exec bound git calls: run them
+        # concurrently
+        def fetch_counts(url, h):
+            return (repo_metrics[url].count(), repo_metrics[url].count(h))
 
-            upstream_commits = repo_metrics[url].count()
-            upstream_saas_commit_index = repo_metrics[url].count(h)
+        counts = {}
+        if count_pairs:
+            max_workers = min(32, len(count_pairs))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    (url, h): executor.submit(fetch_counts, url, h)
+                    for (url, h) in count_pairs
+                }
+
+            counts = {pair: f.result() for pair, f in futures.items()}
+
+        for service_tuple, service in services.items():
+            context_name = service_tuple[0]
+
+            upstream_commits, upstream_saas_commit_index = \
+                counts[service_pairs[service_tuple]]
 
             service['context'] = context_name
             service['commit'] = self.rev_parse('HEAD')
@@ -280,6 +591,8 @@ class SaasGitMetrics(GitMetrics):
         """
         services_head = self.services_with_info()
 
+        # the comprehension already builds fresh dicts per service, so
+        # there is no need to deep-copy services_head first
         services_history = {
             service_tuple: {
                 k: v
@@ -288,18 +601,30 @@ class SaasGitMetrics(GitMetrics):
                          "commit_ts", "upstream_commits",
                          "upstream_saas_commit_index"]
             }
-            for service_tuple, service in copy.deepcopy(services_head).items()
+            for service_tuple, service in services_head.items()
         }
 
-        services_found = []
-        for index in itertools.count(1):
+        services_dirs = [c['data']['services_dir'] for c in self.contexts]
+
+        # only walk the commits that actually touched the services files;
+        # anything in between cannot change a service hash
+        history_cmd = ['log', '--first-parent', '--format=%H%x00%ct',
+                       'HEAD', '--']
+        history_cmd += services_dirs
+        history_out = self._git_command(history_cmd).decode('utf-8')
+
+        head_sha = self.rev_parse('HEAD')
+
+        services_found = set()
+        for line in history_out.splitlines():
             if len(services_found) == len(services_head):
                 break
 
-            commit = "HEAD~{}".format(index)
+            commit, _, commit_ts = line.partition('\x00')
+            commit_ts = int(commit_ts)
 
-            commit_hash = self.rev_parse(commit)
-            commit_ts = self.commit_ts(commit)
+            if commit == head_sha:
+                continue
 
             services_commit = self.services(commit)
 
@@ -314,7 +639,7 @@ class SaasGitMetrics(GitMetrics):
 
                 if not commit_hash or service.get('hash') != commit_hash or \
                         not self.is_sha(service.get('hash')):
-                    services_found.append(service_tuple)
+                    services_found.add(service_tuple)
                 else:
                     services_history[service_tuple]['commit'] = commit_hash
                     services_history[service_tuple]['commit_ts'] = \
@@ -16,8 +16,7 @@ import vault_client
 
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
-# TODO: For some reason it's faster if pool size is 0
-POOL_SIZE = os.getenv('POOL_SIZE', 0)
+POOL_SIZE = int(os.getenv('POOL_SIZE', '0'))
 
 # Clone the repos to this path
 CACHE_DIR = os.getenv('CACHE_DIR', '.cache')
@@ -68,7 +67,8 @@ def pgw_auth_handler(pgw_config):
 
 
 if __name__ == "__main__":
-    config = toml.loads(base64.b64decode(os.environ['CONFIG_TOML']))
+    config_toml = base64.b64decode(os.environ['CONFIG_TOML']).decode('utf-8')
+    config = toml.loads(config_toml)
     init_vault_client(config)
     pgw_config = vault_client.read_all(config['pushgateway']['secret_path'])
 
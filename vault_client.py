@@ -4,6 +4,11 @@ import hvac
 
 _client = None
 
+# secrets re-read within a push are served from here instead of
+# round-tripping to Vault: {path: (expiry_ts, data)}
+_secret_cache = {}
+_SECRET_CACHE_TTL = 60
+
 
 class SecretNotFound(Exception):
     pass
@@ -37,21 +42,34 @@ def init(server, role_id, secret_id):
                 time.sleep(1)
 
         if not authenticated:
+            _secret_cache.clear()
             raise VaultConnectionError()
 
         _client = client
 
 
-def read(path, field):
-    global _client
+def _read_data(path):
+    now = time.time()
+
+    cached = _secret_cache.get(path)
+    if cached is not None and cached[0] > now:
+        return cached[1]
 
     secret = _client.read(path)
 
     if secret is None or 'data' not in secret:
         raise SecretNotFound(path)
 
+    _secret_cache[path] = (now + _SECRET_CACHE_TTL, secret['data'])
+
+    return secret['data']
+
+
+def read(path, field):
+    data = _read_data(path)
+
     try:
-        secret_field = secret['data'][field]
+        secret_field = data[field]
     except KeyError:
         raise SecretFieldNotFound("{}/{}".format(path, field))
 
@@ -59,14 +77,7 @@ def read(path, field):
 
 
 def read_all(path):
-    global _client
-
-    secret = _client.read(path)
-
-    if secret is None or 'data' not in secret:
-        raise SecretNotFound(path)
-
-    return secret['data']
+    return _read_data(path)
 
 
 def read_all_v2(path, version):